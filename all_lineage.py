@@ -1,42 +1,398 @@
 import json
 import csv
+import io
+import multiprocessing
 import os
 import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def extract_column_lineage(manifest_path, catalog_path, output_dir="lineage_output"):
-    """
-    Extract column lineage information from dbt manifest and catalog files.
-    
-    Args:
-        manifest_path: Path to dbt manifest.json
-        catalog_path: Path to dbt catalog.json
-        output_dir: Directory to save output files
+# Word tokens, matching the \b boundaries used by the column patterns
+_IDENT_RE = re.compile(r'\w+')
+
+# Pieces of the select/as heuristic that are located once per model
+_CLAUSE_RE = re.compile(r'select|,')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Characters that force csv.writer to quote a field
+_CSV_SPECIAL_RE = re.compile(r'[,"\r\n]')
+
+# Below this many models, process startup costs more than it saves
+_PARALLEL_MIN_MODELS = 64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def load_json(path):
+    """Load a JSON file, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def load_model_columns(catalog_path):
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Load manifest and catalog files
-    with open(manifest_path, 'r') as f:
-        manifest = json.load(f)
+    Load the column names of every table and view in a dbt catalog.json.
     
-    with open(catalog_path, 'r') as f:
-        catalog = json.load(f)
+    With ijson installed the catalog is streamed one node at a time, so only the
+    column names are kept in memory rather than the whole parsed catalog.
     
-    # Extract nodes (models) from manifest
-    nodes = manifest.get('nodes', {})
+    Returns:
+        Dict of catalog node -> list of column names
+    """
+    if ijson is None:
+        catalog_nodes = load_json(catalog_path).get('nodes', {}).items()
+        return _model_columns_from_nodes(catalog_nodes)
     
-    # Get column information from catalog
+    with open(catalog_path, 'rb') as f:
+        return _model_columns_from_nodes(ijson.kvitems(f, 'nodes'))
+
+def _model_columns_from_nodes(catalog_nodes):
+    """Collect column names from (node name, catalog node) pairs."""
     model_columns = {}
-    for node_name, node in catalog.get('nodes', {}).items():
+    for node_name, node in catalog_nodes:
         if node.get('metadata', {}).get('type') in ('table', 'view'):
             columns = node.get('columns', {})
             model_columns[node_name] = list(columns.keys())
     
-    # Initialize lineage dictionary
-    column_lineage = {}
+    return model_columns
+
+def write_json(data, path):
+    """Write data to a JSON file with 2-space indentation."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
+    # Serialize up front so the file gets one large write instead of many small ones
+    blob = json.dumps(data, indent=2)
+    with open(path, 'w', buffering=1 << 20) as f:
+        f.write(blob)
+
+def write_csv_rows(f, header, rows):
+    """
+    Write a header and rows to an open CSV file.
+    
+    Lineage rows are plain model and column names, so they are joined directly
+    instead of going through csv.writer. Rows that need quoting fall back to csv.writer.
+    
+    Args:
+        f: File opened for writing with newline=''
+        header: List of column headers
+        rows: List of rows, each a list of values
+    """
+    needs_quoting = any(
+        isinstance(value, str) and _CSV_SPECIAL_RE.search(value)
+        for row in rows
+        for value in row
+    )
+    if needs_quoting:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+    
+    buf = io.StringIO()
+    buf.write(','.join(header) + '\r\n')
+    for row in rows:
+        buf.write(','.join(map(str, row)) + '\r\n')
+    f.write(buf.getvalue())
+
+def sql_identifiers(sql):
+    """Return the set of word tokens appearing in a lowercased SQL string."""
+    return frozenset(_IDENT_RE.findall(sql))
+
+def compile_column_database(pattern_names):
+    """
+    Compile lowercase column names into a single Hyperscan database, so one scan
+    of a lowercased SQL string finds every name that might be mentioned.
+    
+    Hyperscan only supports \\b in ASCII mode, which disagrees with Python's re
+    next to non-ASCII characters. The database therefore matches the bare names,
+    and each hit is confirmed with the column's whole-word re pattern.
+    
+    Args:
+        pattern_names: Lowercase column name for each column id
+    """
+    flags = hyperscan.HS_FLAG_SINGLEMATCH
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[re.escape(name).encode('utf-8') for name in pattern_names.values()],
+        ids=list(pattern_names),
+        elements=len(pattern_names),
+        flags=[flags] * len(pattern_names)
+    )
+    return db
+
+def sql_column_ids(sql, col_ids, pattern_cols, pattern_db=None):
+    """
+    Return the ids of the catalog columns mentioned in a SQL string.
+    
+    Args:
+        sql: Lowercased compiled SQL for a model
+        col_ids: Column id for each lowercase column name
+        pattern_cols: Compiled pattern for each column id whose name isn't a single word token
+        pattern_db: Optional Hyperscan database of the same names, scanned in one pass
+            to find which pattern_cols are worth searching
+    """
+    found = set()
+    for token in sql_identifiers(sql):
+        col_id = col_ids.get(token)
+        if col_id is not None:
+            found.add(col_id)
+    
+    if pattern_db is not None:
+        candidates = set()
+        pattern_db.scan(sql.encode('utf-8'), match_event_handler=lambda col_id, *_: candidates.add(col_id))
+    else:
+        candidates = pattern_cols
+    
+    for col_id in candidates:
+        if pattern_cols[col_id].search(sql):
+            found.add(col_id)
+    
+    return frozenset(found)
+
+def mentioned_positions(sql_col_ids, col_id_lists, present=None):
+    """
+    For each list of column ids, return the positions of ids mentioned in the SQL.
+    
+    Args:
+        sql_col_ids: Column ids mentioned in the SQL
+        col_id_lists: Column ids of each node to check
+        present: Reusable NumPy bool buffer with one slot per column id. When given,
+            col_id_lists must be NumPy int arrays and the lookups are vectorized.
+    """
+    if present is None:
+        return [
+            [pos for pos, col_id in enumerate(col_id_list) if col_id in sql_col_ids]
+            for col_id_list in col_id_lists
+        ]
+    
+    mentioned = np.fromiter(sql_col_ids, dtype=np.intp, count=len(sql_col_ids))
+    present[mentioned] = True
+    try:
+        return [np.flatnonzero(present[col_id_list]).tolist() for col_id_list in col_id_lists]
+    finally:
+        present[mentioned] = False
+
+def find_task_positions(tasks, node_ids, node_cols, n_cols):
+    """
+    For each model task, find which columns of the model and of each dependency
+    its SQL mentions.
+    
+    Uses a NumPy presence mask when NumPy is installed, and plain set lookups otherwise.
+    
+    Args:
+        tasks: List of (node name, compiled SQL, dependency names, mentioned column ids)
+        node_ids: Id of each catalog node
+        node_cols: Column ids of each catalog node, by node id
+        n_cols: Number of distinct column ids
+    
+    Returns:
+        List with, for each task, the mentioned column positions of the model
+        followed by those of each dependency
+    """
+    task_nodes = [
+        [node_ids[node_name]] + [node_ids[dep_node] for dep_node in depends_on]
+        for node_name, _, depends_on, _ in tasks
+    ]
+    
+    # With NumPy, column membership is checked against a presence mask for the
+    # current SQL; the mask is cleared after each model so it is only allocated once
+    present = None
+    if np is not None:
+        node_cols = [np.asarray(ids, dtype=np.intp) for ids in node_cols]
+        present = np.zeros(n_cols, dtype=bool)
+    
+    return [
+        mentioned_positions(sql_col_ids, [node_cols[node_id] for node_id in pair_nodes], present)
+        for (_, _, _, sql_col_ids), pair_nodes in zip(tasks, task_nodes)
+    ]
+
+def _to_plain(lineage):
+    """Convert nested defaultdicts back to plain dicts."""
+    if isinstance(lineage, dict):
+        return {key: _to_plain(value) for key, value in lineage.items()}
+    return lineage
+
+def _in_any_range(positions, ranges):
+    """Return whether any of the sorted positions falls in one of the inclusive (low, high) ranges."""
+    for low, high in ranges:
+        i = bisect_left(positions, low)
+        if i < len(positions) and positions[i] <= high:
+            return True
+    return False
+
+def _analyze_node(task):
+    """
+    Attribute a model's columns to the dependency columns its SQL uses.
+    
+    A model column uses a dependency column when the SQL matches either
     
-    # Process each model
+        \\bmodel_col\\s*=.*\\bcol\\b
+        (?:select|,)\\s*.*\\bcol\\b.*\\s+as\\s+\\bmodel_col\\b
+    
+    Compiling those for every (model column, dependency column) pair dominated
+    the run time, so each name is located once and pairs are compared by
+    position. "." never matches a newline, which is what bounds the positions.
+    
+    Args:
+        task: Tuple of (node name, lowercased compiled SQL, model columns that can
+            match, list of (dependency, dependency columns named in the SQL))
+    
+    Returns:
+        Tuple of (node name, list of (model column, dependency, dependency column) edges)
+    """
+    node_name, compiled_sql, model_cols, deps = task
+    edges = []
+    
+    runs = [m.span() for m in _WHITESPACE_RE.finditer(compiled_sql)]
+    run_starts = [start for start, _ in runs]
+    run_start_by_end = {end: start for start, end in runs}
+    clause_ends = [m.end() for m in _CLAUSE_RE.finditer(compiled_sql)]
+    
+    def line_start(pos):
+        return compiled_sql.rfind('\n', 0, pos) + 1
+    
+    def follows_clause(pos):
+        # "(?:select|,)\s*.*" can end at pos if a clause ends on pos's line, or
+        # before it with only whitespace up to that line
+        start = line_start(pos)
+        if start:
+            start = runs[bisect_right(run_starts, start - 1) - 1][0]
+        i = bisect_left(clause_ends, start)
+        return i < len(clause_ends) and clause_ends[i] <= pos
+    
+    # For each model column, where a dependency column may start for the usage
+    # pattern and where it may end for the select/as pattern
+    usage_ranges = {}
+    select_ranges = {}
+    for model_col in dict.fromkeys(model_col.lower() for model_col in model_cols):
+        escaped = re.escape(model_col)
+        
+        usage_ranges[model_col] = []
+        for m in re.finditer(r'(?=(\b' + escaped + r'\s*=))', compiled_sql):
+            line_end = compiled_sql.find('\n', m.end(1))
+            usage_ranges[model_col].append((m.end(1), line_end if line_end != -1 else len(compiled_sql)))
+        
+        # "as" must follow whitespace, and the column must end before that
+        # whitespace on the same line or inside it
+        select_ranges[model_col] = []
+        for m in re.finditer(r'(?=as\s+\b' + escaped + r'\b)', compiled_sql):
+            run_start = run_start_by_end.get(m.start())
+            if run_start is not None:
+                select_ranges[model_col].append((line_start(run_start), m.start() - 1))
+    
+    # Where each dependency column starts, and where it ends after a select or comma
+    col_starts = {}
+    col_select_ends = {}
+    for _, dep_cols in deps:
+        for col in dep_cols:
+            col = col.lower()
+            if col not in col_starts:
+                starts = [m.start() for m in re.finditer(r'(?=\b' + re.escape(col) + r'\b)', compiled_sql)]
+                col_starts[col] = starts
+                col_select_ends[col] = [start + len(col) for start in starts if follows_clause(start)]
+    
+    # For each dependency, check which columns are referenced
+    for dep_node, dep_cols in deps:
+        # Simple heuristic: a column name from the dependency appears in the SQL.
+        # This is simplified; a proper SQL parser would be better
+        for col in dep_cols:
+            starts = col_starts[col.lower()]
+            select_ends = col_select_ends[col.lower()]
+            
+            # Find which columns in this model likely use the dependent column
+            for model_col in model_cols:
+                # Another simple heuristic
+                if _in_any_range(starts, usage_ranges[model_col.lower()]) or \
+                   _in_any_range(select_ends, select_ranges[model_col.lower()]):
+                    edges.append((model_col, dep_node, col))
+    
+    return node_name, edges
+
+def _available_cpus():
+    """Return the number of CPUs this process is allowed to run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def build_column_lineage(nodes, model_columns, workers=1):
+    """
+    Build column-to-column lineage for every model in the manifest.
+    
+    Args:
+        nodes: Manifest nodes keyed by unique id
+        model_columns: Column names for each catalog node
+        workers: Number of worker processes; 1 (the default) runs serially and
+            None uses every CPU available to the process. Workers are spawned,
+            so callers that enable them need an if __name__ == "__main__" guard
+    
+    Returns:
+        Dict of model -> column -> upstream model -> list of upstream columns
+    """
+    column_lineage = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    
+    # Intern catalog nodes and columns as integer ids so the matching loops
+    # compare ints. Columns match case-insensitively, so ids are keyed on the
+    # lowercase name; node_cols[i][pos] is the id of model_columns[node_names[i]][pos].
+    node_ids = {}
+    node_names = []
+    node_cols = []
+    col_ids = {}
+    pattern_names = {}
+    for node_name, cols in model_columns.items():
+        node_ids[node_name] = len(node_names)
+        node_names.append(node_name)
+        
+        ids = []
+        for col in cols:
+            key = col.lower()
+            col_id = col_ids.get(key)
+            if col_id is None:
+                col_id = len(col_ids)
+                col_ids[key] = col_id
+                if not _IDENT_RE.fullmatch(key):
+                    pattern_names[col_id] = key
+            ids.append(col_id)
+        node_cols.append(ids)
+    
+    # Names with spaces or punctuation can't be looked up as a single token, so
+    # they are searched for by pattern. When Hyperscan is available one scan
+    # first narrows down which patterns need searching.
+    pattern_cols = {
+        col_id: re.compile(r'\b' + re.escape(col) + r'\b')
+        for col_id, col in pattern_names.items()
+    }
+    pattern_db = None
+    if hyperscan is not None and pattern_names:
+        pattern_db = compile_column_database(pattern_names)
+    
+    # Collect each model with its dependencies and the column ids its SQL mentions.
+    # Models that share a SQL body (e.g. copies of the same template) are
+    # tokenized once; keys are the lowercased SQL itself, since each lower()
+    # call returns a new string and an id() key would never hit.
+    tasks = []
+    sql_ident_cache = {}
     for node_name, node in nodes.items():
         if node.get('resource_type') == 'model':
             # Get compiled SQL
@@ -44,101 +400,144 @@ def extract_column_lineage(manifest_path, catalog_path, output_dir="lineage_outp
             if not compiled_sql:
                 continue
             
+            # Lowercase once so no pattern needs re.IGNORECASE
+            compiled_sql = compiled_sql.lower()
+            
             # Get model columns
-            if node_name not in model_columns:
+            if node_name not in node_ids:
                 continue
             
-            model_cols = model_columns[node_name]
-            
             # Get dependencies
-            depends_on = node.get('depends_on', {}).get('nodes', [])
+            depends_on = [
+                dep_node for dep_node in node.get('depends_on', {}).get('nodes', [])
+                if dep_node in node_ids
+            ]
             
-            # For each dependency, check which columns are referenced
-            for dep_node in depends_on:
-                if dep_node not in model_columns:
-                    continue
-                
-                dep_cols = model_columns[dep_node]
-                
-                # Simple heuristic: check if a column name from dependency appears in SQL
-                for col in dep_cols:
-                    # Add basic column name pattern matching
-                    # This is simplified; a proper SQL parser would be better
-                    col_pattern = r'\b' + re.escape(col) + r'\b'
-                    if re.search(col_pattern, compiled_sql):
-                        # Record lineage
-                        if node_name not in column_lineage:
-                            column_lineage[node_name] = {}
-                        
-                        # Find which columns in this model likely use the dependent column
-                        for model_col in model_cols:
-                            # Another simple heuristic
-                            col_usage_pattern = r'\b' + re.escape(model_col) + r'\s*=.*\b' + re.escape(col) + r'\b'
-                            col_in_select = r'(?:select|,)\s*.*\b' + re.escape(col) + r'\b.*\s+as\s+\b' + re.escape(model_col) + r'\b'
-                            
-                            if re.search(col_usage_pattern, compiled_sql, re.IGNORECASE) or \
-                               re.search(col_in_select, compiled_sql, re.IGNORECASE):
-                                if model_col not in column_lineage[node_name]:
-                                    column_lineage[node_name][model_col] = {}
-                                
-                                if dep_node not in column_lineage[node_name][model_col]:
-                                    column_lineage[node_name][model_col][dep_node] = []
-                                
-                                column_lineage[node_name][model_col][dep_node].append(col)
+            # Tokenize the SQL once so column checks are int lookups
+            sql_col_ids = sql_ident_cache.get(compiled_sql)
+            if sql_col_ids is None:
+                sql_col_ids = sql_column_ids(compiled_sql, col_ids, pattern_cols, pattern_db)
+                sql_ident_cache[compiled_sql] = sql_col_ids
+            tasks.append((node_name, compiled_sql, depends_on, sql_col_ids))
+    
+    # Find which columns of each model and its dependencies the SQL names
+    task_positions = find_task_positions(tasks, node_ids, node_cols, len(col_ids))
+    
+    # Only model columns named in the SQL can be matched, so each task carries
+    # just those names; this also keeps what is sent to worker processes small.
+    # The usage heuristic has no \b after the model column, so a name ending in
+    # punctuation ("total (usd)") can match without passing the whole-word
+    # check; such names are always kept.
+    node_tasks = []
+    for (node_name, compiled_sql, depends_on, _), node_positions in zip(tasks, task_positions):
+        model_positions, *dep_positions = node_positions
+        
+        # A model gets an entry, possibly empty, as soon as any dependency
+        # column appears in its SQL
+        if not any(dep_positions):
+            continue
+        column_lineage[node_name] = defaultdict(lambda: defaultdict(list))
+        
+        mentioned = set(model_positions)
+        model_cols = [
+            model_col for pos, model_col in enumerate(model_columns[node_name])
+            if pos in mentioned or not _IDENT_RE.fullmatch(model_col)
+        ]
+        if not model_cols:
+            continue
+        
+        deps = []
+        for dep_node, positions in zip(depends_on, dep_positions):
+            if positions:
+                deps.append((dep_node, [model_columns[dep_node][pos] for pos in positions]))
+        if deps:
+            node_tasks.append((node_name, compiled_sql, model_cols, deps))
+    
+    # Models are analyzed independently, so fan them out across processes.
+    # Workers are spawned rather than forked, since forking after native
+    # libraries have started threads can deadlock.
+    if workers is None:
+        workers = _available_cpus()
+    if workers > 1 and len(node_tasks) >= _PARALLEL_MIN_MODELS:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(_analyze_node, node_tasks, chunksize=32))
+    else:
+        results = map(_analyze_node, node_tasks)
+    
+    for node_name, edges in results:
+        for model_col, dep_node, col in edges:
+            column_lineage[node_name][model_col][dep_node].append(col)
+    
+    return _to_plain(column_lineage)
+
+def extract_column_lineage(manifest_path, catalog_path, output_dir="lineage_output", workers=1):
+    """
+    Extract column lineage information from dbt manifest and catalog files.
+    
+    Args:
+        manifest_path: Path to dbt manifest.json
+        catalog_path: Path to dbt catalog.json
+        output_dir: Directory to save output files
+        workers: Number of worker processes for lineage extraction; None uses
+            every available CPU (default: 1, serial)
+    """
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Load manifest file
+    manifest = load_json(manifest_path)
+    
+    # Extract nodes (models) from manifest
+    nodes = manifest.get('nodes', {})
+    
+    # Get column information from catalog
+    model_columns = load_model_columns(catalog_path)
+    
+    # Build the column-to-column lineage
+    column_lineage = build_column_lineage(nodes, model_columns, workers)
     
     # Export lineage to JSON
     json_output_path = os.path.join(output_dir, "column_lineage.json")
-    with open(json_output_path, 'w') as f:
-        json.dump(column_lineage, f, indent=2)
+    write_json(column_lineage, json_output_path)
     
     # Export to CSV for easier analysis
     csv_output_path = os.path.join(output_dir, "column_lineage.csv")
-    with open(csv_output_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Model", "Column", "Upstream Model", "Upstream Column"])
-        
+    with open(csv_output_path, 'w', newline='', buffering=1 << 20) as f:
+        # Invert the lineage to show downstream relationships in the same pass
+        rows = []
+        downstream_lineage = defaultdict(lambda: defaultdict(list))
         for model, columns in column_lineage.items():
             for column, upstreams in columns.items():
                 for upstream_model, upstream_columns in upstreams.items():
                     for upstream_column in upstream_columns:
-                        writer.writerow([
+                        rows.append([
                             model.split('.')[-1],  # Extract model name
                             column,
                             upstream_model.split('.')[-1],  # Extract upstream model name
                             upstream_column
                         ])
+                        downstream_lineage[upstream_model][upstream_column].append((model, column))
+        
+        write_csv_rows(f, ["Model", "Column", "Upstream Model", "Upstream Column"], rows)
     
     # Generate downstream lineage CSV
     downstream_csv_path = os.path.join(output_dir, "downstream_lineage.csv")
-    with open(downstream_csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Model", "Column", "Downstream Model", "Downstream Column"])
-        
-        # Invert the lineage to show downstream relationships
-        downstream_lineage = {}
-        for model, columns in column_lineage.items():
-            for column, upstreams in columns.items():
-                for upstream_model, upstream_columns in upstreams.items():
-                    for upstream_column in upstream_columns:
-                        if upstream_model not in downstream_lineage:
-                            downstream_lineage[upstream_model] = {}
-                        
-                        if upstream_column not in downstream_lineage[upstream_model]:
-                            downstream_lineage[upstream_model][upstream_column] = []
-                        
-                        downstream_lineage[upstream_model][upstream_column].append((model, column))
-        
+    with open(downstream_csv_path, 'w', newline='', buffering=1 << 20) as f:
         # Write to CSV
+        rows = []
         for model, columns in downstream_lineage.items():
             for column, downstreams in columns.items():
                 for downstream in downstreams:
                     downstream_model, downstream_column = downstream
-                    writer.writerow([
+                    rows.append([
                         model.split('.')[-1],  # Extract model name
                         column,
                         downstream_model.split('.')[-1],  # Extract downstream model name
                         downstream_column
                     ])
+        
+        write_csv_rows(f, ["Model", "Column", "Downstream Model", "Downstream Column"], rows)
     
     print(f"Column lineage exported to {json_output_path}")
     print(f"CSV lineage exported to {csv_output_path}")
@@ -153,7 +552,8 @@ if __name__ == "__main__":
     parser.add_argument("--manifest", required=True, help="Path to dbt manifest.json")
     parser.add_argument("--catalog", required=True, help="Path to dbt catalog.json")
     parser.add_argument("--output", default="lineage_output", help="Output directory")
+    parser.add_argument("--workers", type=int, help="Worker processes for lineage extraction (default: all available CPUs, 1 disables)")
     
     args = parser.parse_args()
     
-    extract_column_lineage(args.manifest, args.catalog, args.output)
+    extract_column_lineage(args.manifest, args.catalog, args.output, args.workers)
@@ -1,29 +1,41 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import os
 import subprocess
 import tempfile
+from pathlib import Path
+
+try:
+    from sqlfluff.core import FluffConfig, Linter
+except ImportError:
+    Linter = None
+
+# Directories that never hold project models but can dominate walk time
+SKIP_DIRS = {'.git', 'target', 'dbt_packages', 'node_modules', '.venv'}
 
 def find_sql_file(filename: str) -> str:
     """Find SQL file in current directory and subdirectories."""
+    # Use the path directly if one was given
+    if os.path.dirname(filename) and os.path.isfile(filename):
+        return os.path.abspath(filename)
+    
     # Remove .sql extension if provided
     base_name = filename.replace('.sql', '')
     
     # Search patterns to try
     patterns = [f"{base_name}.sql", base_name]
     
-    # Walk through directories
-    for root, _, files in os.walk('.'):
+    # Walk through directories, stopping at the first match
+    for root, dirs, files in os.walk('.'):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
         for pattern in patterns:
-            for file in files:
-                if pattern == file:
-                    return os.path.abspath(os.path.join(root, file))
+            if pattern in files:
+                return os.path.abspath(os.path.join(root, pattern))
     
     return None
 
-def create_config_file() -> str:
-    """Create a temporary config file with the specified SQLFluff rules."""
-    config_content = """[sqlfluff]
+SQLFLUFF_CONFIG = """[sqlfluff]
 dialect = redshift 
 templater = dbt
 max_line_length = 120
@@ -111,17 +123,95 @@ operator_new_lines = before
 [sqlfluff:rules:convention.select_trailing_comma]
 select_clause_trailing_comma = forbid
 """
-    # Create a temporary file
+
+def create_config_file() -> str:
+    """Create a temporary config file with the specified SQLFluff rules."""
     fd, path = tempfile.mkstemp(suffix='.sqlfluff')
     with os.fdopen(fd, 'w') as f:
-        f.write(config_content)
+        f.write(SQLFLUFF_CONFIG)
     
     return path
 
-def run_sqlfluff(filename: str, config_path: str, project_dir: str) -> bool:
-    """Run SQLFluff fix on the specified file."""
+def get_config_file() -> tuple:
+    """
+    Return a config file with the specified SQLFluff rules, creating it once per config version.
+    
+    Returns:
+        Tuple of (config path, whether it is a temporary file the caller must remove)
+    """
+    # Cache the config by content hash so repeated runs reuse the same file.
+    # Like other XDG tools, an empty or relative XDG_CACHE_HOME is ignored.
+    digest = hashlib.blake2b(SQLFLUFF_CONFIG.encode(), digest_size=8).hexdigest()
     try:
-        print(f"Running SQLFluff on {filename}")
+        cache_home = os.environ.get('XDG_CACHE_HOME', '')
+        if not os.path.isabs(cache_home):
+            cache_home = Path.home() / '.cache'
+        cache_dir = Path(cache_home) / 'monitring_lint'
+        path = cache_dir / f"{digest}.sqlfluff"
+        if path.exists():
+            return str(path), False
+        
+        # Write to a temporary file and rename it so concurrent runs never see a partial config
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(SQLFLUFF_CONFIG)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        return str(path), False
+    except (OSError, RuntimeError):
+        # The cache can't be written (e.g. a read-only home directory in CI),
+        # so fall back to a one-off temporary config
+        return create_config_file(), True
+
+def lint_in_process(filenames: list, config_path: str, project_dir: str) -> bool:
+    """Run SQLFluff fix on the specified files using the sqlfluff library."""
+    cwd = os.getcwd()
+    try:
+        print(f"Running SQLFluff on {', '.join(filenames)}")
+        print(f"Using config: {config_path}")
+        print(f"Project directory: {project_dir}")
+        
+        # The dbt templater resolves project_dir relative to the working directory
+        os.chdir(project_dir)
+        
+        # One linter for all files, so rules and templater state are built once.
+        # The config is passed as a file like --config, since per-file configs
+        # only inherit settings loaded from an extra config path.
+        linter = Linter(config=FluffConfig.from_root(extra_config_path=config_path))
+        result = linter.lint_paths(tuple(filenames), fix=True, apply_fixes=True)
+        
+        print("SQLFluff output:")
+        for record in result.as_records():
+            for violation in record["violations"]:
+                line_no = violation.get("start_line_no", violation.get("line_no"))
+                print(f"{record['filepath']}:{line_no} {violation['code']} {violation['description']}")
+        print(f"{result.num_violations()} violation(s) found")
+        
+        # Like the CLI, fail when a file could not be templated or parsed
+        _, num_errors = result.count_tmp_prs_errors()
+        if num_errors:
+            print(f"{num_errors} templating or parsing error(s) found")
+            return False
+        
+        return True
+    except Exception as e:
+        print(f"❌ Error running SQLFluff: {str(e)}")
+        return False
+    finally:
+        os.chdir(cwd)
+
+def run_sqlfluff(filenames: list, config_path: str, project_dir: str) -> bool:
+    """Run SQLFluff fix on the specified files."""
+    try:
+        print(f"Running SQLFluff on {', '.join(filenames)}")
         print(f"Using config: {config_path}")
         print(f"Project directory: {project_dir}")
         
@@ -129,7 +219,7 @@ def run_sqlfluff(filename: str, config_path: str, project_dir: str) -> bool:
             [
                 "sqlfluff", 
                 "fix", 
-                filename,
+                *filenames,
                 "--config", 
                 config_path,
                 "--verbose"
@@ -154,29 +244,41 @@ def run_sqlfluff(filename: str, config_path: str, project_dir: str) -> bool:
 
 def main():
     parser = argparse.ArgumentParser(description="SQLFluff Linter for dbt models")
-    parser.add_argument("filename", help="SQL file name (with or without path)")
+    parser.add_argument("filenames", nargs="+", help="SQL file names (with or without path)")
     parser.add_argument("--project-dir", help="dbt project directory (default: current directory)", default=os.getcwd())
     args = parser.parse_args()
 
-    # Find the SQL file
-    file_path = find_sql_file(args.filename)
-    if not file_path:
-        print(f"❌ Error: Could not find SQL file '{args.filename}'")
+    # Find the SQL files
+    file_paths = []
+    for filename in args.filenames:
+        file_path = find_sql_file(filename)
+        if not file_path:
+            print(f"❌ Error: Could not find SQL file '{filename}'")
+            continue
+        
+        print(f"Found SQL file: {file_path}")
+        file_paths.append(file_path)
+    
+    if not file_paths:
         return
-
-    print(f"Found SQL file: {file_path}")
     
-    # Create temporary config file
-    config_path = create_config_file()
+    # Get the cached config file
+    config_path, temporary = get_config_file()
     try:
-        # Run SQLFluff
-        if run_sqlfluff(file_path, config_path, args.project_dir):
-            print(f"✅ Successfully linted: {file_path}")
+        # Run SQLFluff in-process when it is importable, otherwise through the CLI
+        if Linter is not None:
+            success = lint_in_process(file_paths, config_path, args.project_dir)
         else:
-            print(f"❌ SQLFluff encountered issues with: {file_path}")
+            success = run_sqlfluff(file_paths, config_path, args.project_dir)
     finally:
-        # Clean up temporary config file
-        os.remove(config_path)
+        # Clean up a temporary config file
+        if temporary:
+            os.remove(config_path)
+    
+    if success:
+        print(f"✅ Successfully linted: {', '.join(file_paths)}")
+    else:
+        print(f"❌ SQLFluff encountered issues with: {', '.join(file_paths)}")
 
 if __name__ == "__main__":
     main()
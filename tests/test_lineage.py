@@ -0,0 +1,221 @@
+import csv
+import io
+import random
+import re
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import all_lineage
+import single_model
+
+HEADER = ["Model", "Column", "Upstream Model", "Upstream Column"]
+
+# Overlapping, multi-word and case-variant names, a name ending in punctuation,
+# a dependency listed twice, dependencies missing from the catalog, and a model
+# whose SQL mentions a dependency column without matching any of its own
+FIXED_NODES = {
+    "model.p.orders": {
+        "resource_type": "model",
+        "compiled_sql": "select order id = user_id,\namount as Amount,\nstatus = created + 1,\ntotal (usd) = created from stg",
+        "depends_on": {"nodes": ["model.p.stg", "model.p.stg", "source.p.raw", "model.p.missing"]},
+    },
+    "model.p.stg": {
+        "resource_type": "model",
+        "compiled_sql": "select created = user_id",
+        "depends_on": {"nodes": ["source.p.raw"]},
+    },
+    "model.p.unmatched": {
+        "resource_type": "model",
+        "compiled_sql": "select USER_ID from stg",
+        "depends_on": {"nodes": ["model.p.stg"]},
+    },
+    "seed.p.ignored": {
+        "resource_type": "seed",
+        "compiled_sql": "select id = user_id",
+        "depends_on": {"nodes": ["model.p.stg"]},
+    },
+}
+FIXED_COLUMNS = {
+    "model.p.orders": ["id", "order id", "Amount", "status", "total (usd)"],
+    "model.p.stg": ["user_id", "AMOUNT", "amount", "created"],
+    "model.p.unmatched": ["x"],
+    "seed.p.ignored": ["id"],
+}
+
+def random_project(seed, n_models=30):
+    """Build a random manifest and catalog from a small vocabulary of SQL tokens and column names."""
+    rng = random.Random(seed)
+    names = [f"model.p.m{i}" for i in range(n_models)]
+    pool = [f"c{i}" for i in range(10)] + ["id", "order id", "Amount", "amount", "User_ID", "a-b", "date"]
+    keywords = ["select", "SELECT", ",", "as", "AS", "=", "+", "(", ")", "from", "where", "\n", "x."]
+    
+    nodes = {}
+    model_columns = {}
+    for name in names:
+        model_columns[name] = list(dict.fromkeys(rng.choice(pool) for _ in range(rng.randint(0, 8))))
+        tokens = [rng.choice(pool + keywords + keywords) for _ in range(rng.randint(0, 60))]
+        nodes[name] = {
+            "resource_type": "model",
+            "compiled_sql": " ".join(tokens),
+            "depends_on": {"nodes": [rng.choice(names) for _ in range(rng.randint(0, 4))]},
+        }
+    return nodes, model_columns
+
+def reference_lineage(nodes, model_columns):
+    """The original per-column regex loop, with case-insensitive mention checks."""
+    column_lineage = {}
+    for node_name, node in nodes.items():
+        compiled_sql = node.get('compiled_sql', '')
+        if node.get('resource_type') != 'model' or not compiled_sql or node_name not in model_columns:
+            continue
+        
+        for dep_node in node.get('depends_on', {}).get('nodes', []):
+            if dep_node not in model_columns:
+                continue
+            
+            for col in model_columns[dep_node]:
+                if not re.search(r'\b' + re.escape(col) + r'\b', compiled_sql, re.IGNORECASE):
+                    continue
+                column_lineage.setdefault(node_name, {})
+                
+                for model_col in model_columns[node_name]:
+                    col_usage_pattern = r'\b' + re.escape(model_col) + r'\s*=.*\b' + re.escape(col) + r'\b'
+                    col_in_select = r'(?:select|,)\s*.*\b' + re.escape(col) + r'\b.*\s+as\s+\b' + re.escape(model_col) + r'\b'
+                    if re.search(col_usage_pattern, compiled_sql, re.IGNORECASE) or \
+                       re.search(col_in_select, compiled_sql, re.IGNORECASE):
+                        column_lineage[node_name].setdefault(model_col, {}).setdefault(dep_node, []).append(col)
+    
+    return column_lineage
+
+class WriteCsvRowsTest(unittest.TestCase):
+    """write_csv_rows must produce exactly what csv.writer would."""
+    
+    def assert_matches_csv_writer(self, rows):
+        expected = io.StringIO(newline='')
+        writer = csv.writer(expected)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+        
+        actual = io.StringIO(newline='')
+        all_lineage.write_csv_rows(actual, HEADER, rows)
+        
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+    
+    def test_plain_rows(self):
+        self.assert_matches_csv_writer([
+            ["orders", "order_id", "stg_orders", "id"],
+            ["orders", "Order Date", "stg_orders", "created_at"],
+            ["orders", "amount", "stg_payments", "amount", 3],
+            ["orders", "", "stg_orders", "ünïcode"],
+        ])
+    
+    def test_rows_that_need_quoting(self):
+        self.assert_matches_csv_writer([
+            ["orders", "a,b", "stg_orders", "id"],
+            ["orders", 'say "hi"', "stg_orders", "id"],
+            ["orders", "line\nbreak", "stg_orders", "carriage\rreturn"],
+            ["orders", "order_id", "stg_orders", "id"],
+        ])
+    
+    def test_no_rows(self):
+        self.assert_matches_csv_writer([])
+
+class BuildColumnLineageTest(unittest.TestCase):
+    """Every matching backend must give the same lineage as the original loop."""
+    
+    def setUp(self):
+        self.projects = [(FIXED_NODES, FIXED_COLUMNS)] + [random_project(seed) for seed in range(25)]
+    
+    def assert_matches_reference(self, workers=1, n_projects=None):
+        for nodes, model_columns in self.projects[:n_projects]:
+            self.assertEqual(
+                all_lineage.build_column_lineage(nodes, model_columns, workers),
+                reference_lineage(nodes, model_columns)
+            )
+    
+    def test_fixed_project(self):
+        lineage = all_lineage.build_column_lineage(FIXED_NODES, FIXED_COLUMNS)
+        self.assertEqual(lineage["model.p.orders"]["id"], {"model.p.stg": ["user_id", "user_id"]})
+        self.assertEqual(lineage["model.p.orders"]["order id"], {"model.p.stg": ["user_id", "user_id"]})
+        self.assertEqual(lineage["model.p.orders"]["total (usd)"], {"model.p.stg": ["created", "created"]})
+        self.assertEqual(lineage["model.p.unmatched"], {})
+        self.assertNotIn("seed.p.ignored", lineage)
+    
+    @unittest.skipIf(all_lineage.np is None, "numpy is not installed")
+    def test_numpy_mask(self):
+        self.assert_matches_reference()
+    
+    def test_pure_python(self):
+        with mock.patch.object(all_lineage, 'np', None):
+            self.assert_matches_reference()
+    
+    @unittest.skipIf(all_lineage.hyperscan is None, "hyperscan is not installed")
+    def test_hyperscan_database(self):
+        self.assert_matches_reference()
+    
+    def test_regex_patterns(self):
+        with mock.patch.object(all_lineage, 'hyperscan', None):
+            self.assert_matches_reference()
+    
+    @unittest.skipIf(all_lineage.hyperscan is None, "hyperscan is not installed")
+    def test_sql_column_ids_backends_agree(self):
+        col_ids = {"id": 0, "order id": 1, "a-b": 2, "x.y": 3, "prix é": 4}
+        pattern_names = {1: "order id", 2: "a-b", 3: "x.y", 4: "prix é"}
+        pattern_cols = {col_id: re.compile(r'\b' + re.escape(name) + r'\b') for col_id, name in pattern_names.items()}
+        pattern_db = all_lineage.compile_column_database(pattern_names)
+        
+        # Hyperscan's ASCII \b sees a boundary inside "caféorder" and none after "é"
+        sqls = [
+            "select order id, a-b from t", "select order idx, xa-b, x.y", "select id", "order  id", "",
+            "select caféorder id as oid from b", "select prix é as p", "select prix éa",
+        ]
+        for sql in sqls:
+            self.assertEqual(
+                all_lineage.sql_column_ids(sql, col_ids, pattern_cols, pattern_db),
+                all_lineage.sql_column_ids(sql, col_ids, pattern_cols),
+                sql
+            )
+    
+    def test_worker_processes(self):
+        with mock.patch.object(all_lineage, '_PARALLEL_MIN_MODELS', 1):
+            # Each call starts its own pool, so only check a few projects
+            self.assert_matches_reference(workers=2, n_projects=4)
+
+class FlattenLineageTest(unittest.TestCase):
+    """flatten_lineage walks nested lineage depth-first, expanding each column once."""
+    
+    def test_two_level_chain(self):
+        lineage = {"a": {"x": {"b": {"y": {"c": {"z": {}}}}}}}
+        self.assertEqual(single_model.flatten_lineage(lineage), [
+            ("a", "x", "b", "y", 1),
+            ("b", "y", "c", "z", 2),
+        ])
+    
+    def test_diamond(self):
+        # b.y and c.y both come from d.z, and a.w reuses b.y: every edge is
+        # written, but each shared column is only expanded the first time
+        shared = {"d": {"z": {}}}
+        lineage = {"a": {
+            "x": {"b": {"y": shared}, "c": {"y": shared}},
+            "w": {"b": {"y": shared}},
+        }}
+        self.assertEqual(single_model.flatten_lineage(lineage), [
+            ("a", "x", "b", "y", 1),
+            ("b", "y", "d", "z", 2),
+            ("a", "x", "c", "y", 1),
+            ("c", "y", "d", "z", 2),
+            ("a", "w", "b", "y", 1),
+        ])
+    
+    def test_self_cycle(self):
+        lineage = {"a": {"x": {"a": {"x": {"a": {"x": {}}}}}}}
+        self.assertEqual(single_model.flatten_lineage(lineage), [
+            ("a", "x", "a", "x", 1),
+        ])
+
+if __name__ == "__main__":
+    unittest.main()